@@ -1,12 +1,14 @@
 import cv2
 import discord
+import logging
 import math
 import numpy as np
 import os
 import pathlib
 import sys
 
-from asyncio import sleep
+from asyncio import create_task, gather, get_running_loop, sleep, to_thread, Semaphore
+from io import BytesIO
 from time import time
 from collections import defaultdict, deque
 from datetime import datetime
@@ -16,12 +18,44 @@ from mimetypes import guess_extension
 from pprint import pprint
 from typing import List
 
-from ._drive import DriveAPI
-from ._utils import empty_dir
+from ._drive import DriveAPI, SharedLink
+from ._utils import convert_size, empty_dir
+from ._watchdog import StallWatchdog
+
+logger = logging.getLogger("discord_drive")
+
+class _LazyPaginator(Paginator):
+    
+    def __init__(self, pages: list, loader, **kwargs):
+        """Paginator that pulls its pages from an async generator as the user reaches them,
+        always keeping one page loaded ahead so that the next button stays enabled.
+
+        Args:
+            pages (list): Pages that have already been loaded
+            loader: Async generator yielding the remaining pages
+        """
+        super().__init__(pages=pages, **kwargs)
+        self.loader = loader
+    
+    async def load_next(self) -> bool:
+        if self.loader is None:
+            return False
+        try:
+            self.pages.append(await self.loader.__anext__())
+            self.page_count = len(self.pages) - 1
+            return True
+        except StopAsyncIteration:
+            self.loader = None
+            return False
+    
+    async def goto_page(self, page_number: int = 0, *, interaction: discord.Interaction = None):
+        if page_number >= self.page_count:
+            await self.load_next()
+        return await super().goto_page(min(page_number, self.page_count), interaction=interaction)
 
 class DriveAPICommands(discord.ext.commands.Cog, command_attrs = dict(guild_only=True)):
     
-    _drive_state = defaultdict(lambda: defaultdict(id=None, folders=[], files=[]))
+    _drive_state = defaultdict(lambda: defaultdict(id=None, folders=[], files=[], items=[], updated=0))
     _wd_cache = None
     
 
@@ -37,22 +71,119 @@ class DriveAPICommands(discord.ext.commands.Cog, command_attrs = dict(guild_only
         self.root = self.API.ROOT
         self.root_path = pathlib.Path(self.root)
         
-        if self.API.service is not None:
-            items = self.API.search(parent=self.API.ROOT_ID, page_size=100, recursive=True)
-            DriveAPICommands._drive_state[self.root_path]["id"] = self.API.ROOT_ID
-            DriveAPICommands._drive_state[self.root_path]["folders"] = [folder["name"] for folder in items if folder['mimeType'].startswith(self.API.FOLDER_TYPE)]
-            DriveAPICommands._drive_state[self.root_path]["files"] = [file["name"] for file in items if not file['mimeType'].startswith(self.API.FOLDER_TYPE)]
-        
         # self.root_alias = '~'
         self.capacity = 15
         
+        # Seconds a cached listing is trusted for, and how many subfolders are listed ahead of the user
+        self.listing_ttl = 60
+        self.prefetch_budget = 15
+        self.prefetch_concurrency = 4
+        self._prefetching = dict()
+        
+        self.watchdog = StallWatchdog(self, self.API)
+        
+        if self.API.service is not None:
+            try:
+                self._cache_listing(self.root_path, self.API.ROOT_ID)
+            except Exception as error:
+                logger.warning(f"Listing {self.root_path} failed: {type(error).__name__}: {error}")
+        
         DriveAPICommands._wd_cache = defaultdict(lambda: [pathlib.Path(self.root), pathlib.Path(self.root)])
         
     async def _API_ready(self, ctx: discord.ApplicationContext):
+        self.watchdog.start(get_running_loop())
         if not (result := bool(self.API.service)):
             await ctx.send_response("Please use `/authenticate` to validate your Google Account's credentials before using any commands!")
         return result
     
+    def _cache_listing(self, path: pathlib.Path, folder_id: str):
+        # A failed listing is not stored, so it is not mistaken for an empty folder until it goes stale
+        if (items := self.API.search(parent=folder_id, page_size=100, recursive=True)) is None:
+            raise Exception(f"The contents of {path} could not be listed.")
+        self._store_listing(path, folder_id, items)
+    
+    async def _refresh_listing(self, path: pathlib.Path, folder_id: str) -> bool:
+        """Lists a folder on a worker thread, where identical listings share one request, and caches it, logging the failure if it could not be listed
+
+        Returns:
+            bool: Whether the listing was stored
+        """
+        try:
+            await to_thread(self._cache_listing, path, folder_id)
+            return True
+        except Exception as error:
+            logger.warning(f"Listing {path} failed: {type(error).__name__}: {error}")
+            return False
+    
+    def _store_listing(self, path: pathlib.Path, folder_id: str, items: list):
+        DriveAPICommands._drive_state[path]["id"] = folder_id
+        DriveAPICommands._drive_state[path]["folders"] = [folder["name"] for folder in items if folder['mimeType'].startswith(self.API.FOLDER_TYPE)]
+        DriveAPICommands._drive_state[path]["files"] = [file["name"] for file in items if not file['mimeType'].startswith(self.API.FOLDER_TYPE)]
+        DriveAPICommands._drive_state[path]["items"] = items
+        DriveAPICommands._drive_state[path]["updated"] = time()
+        
+        # Remember the id of every subfolder so that moving into one does not need another search
+        for folder in items:
+            if folder['mimeType'].startswith(self.API.FOLDER_TYPE):
+                DriveAPICommands._drive_state[path / folder["name"]]["id"] = folder["id"]
+    
+    def _is_fresh(self, path: pathlib.Path) -> bool:
+        return path in DriveAPICommands._drive_state and time() - DriveAPICommands._drive_state[path]["updated"] < self.listing_ttl
+    
+    def _prefetch(self, path: pathlib.Path):
+        """Starts listing the subfolders of a folder in the background, so that the next `/cd` or `/ls` is answered from the cache
+
+        Args:
+            path (pathlib.Path): Folder whose subfolders should be listed
+        """
+        if path in self._prefetching:
+            return
+        
+        async def prefetch():
+            semaphore = Semaphore(self.prefetch_concurrency)
+            
+            async def fetch(child: pathlib.Path):
+                async with semaphore:
+                    if not self._is_fresh(child):
+                        await to_thread(self._cache_listing, child, DriveAPICommands._drive_state[child]["id"])
+            
+            children = [path / name for name in DriveAPICommands._drive_state[path]["folders"][:self.prefetch_budget]]
+            children = [child for child in children if DriveAPICommands._drive_state[child]["id"]]
+            try:
+                results = await gather(*[fetch(child) for child in children], return_exceptions=True)
+                for child, result in zip(children, results):
+                    if isinstance(result, Exception):
+                        logger.warning(f"Prefetching {child} failed: {type(result).__name__}: {result}")
+            finally:
+                del self._prefetching[path]
+        
+        # Keep a reference to the task so it is not garbage collected before it finishes
+        self._prefetching[path] = create_task(prefetch())
+    
+    def _register_chain(self, chain: list) -> pathlib.Path:
+        """Records the id of every folder in a chain returned by DriveAPI.path_of, so that `..` works from the deepest one
+
+        Args:
+            chain (list): (name, id) of every folder from the root down
+
+        Returns:
+            pathlib.Path: Path of the deepest folder in the chain
+        """
+        path = None
+        for name, folder_id in chain:
+            path = pathlib.Path(name) if path is None else path / name
+            DriveAPICommands._drive_state[path]["id"] = folder_id
+        return path
+    
+    def _release_link(self, file_id: str):
+        # Revoking the grant is a network call, so it runs on a worker thread and is not awaited, which lets it finish even if the command is cancelled
+        get_running_loop().run_in_executor(None, self.API.release_link, file_id)
+    
+    def _kind(self, mime_type: str) -> str:
+        if mime_type.startswith(self.API.NATIVE_TYPE):
+            return "Folder" if mime_type == self.API.FOLDER_TYPE else mime_type.rsplit(".", 1)[1].title()
+        return str(guess_extension(mime_type))[1:].upper()
+    
     async def _get_user_color(self, ctx: discord.ApplicationContext) -> discord.Colour:
         avatar_byte_array = await ctx.author.display_avatar.with_format("png").read()
         arr = np.asarray(bytearray(avatar_byte_array), dtype=np.uint8)
@@ -87,6 +218,7 @@ class DriveAPICommands(discord.ext.commands.Cog, command_attrs = dict(guild_only
         if result:
             files = self.API.search(parent=folder_id, folders=False, page_size=100, recursive=True)
             DriveAPICommands._drive_state[DriveAPICommands._wd_cache[ctx.author.id][0]]["files"] = [file["name"] for file in files]
+            DriveAPICommands._drive_state[DriveAPICommands._wd_cache[ctx.author.id][0]]["updated"] = 0
 
             user_color = await self._get_user_color(ctx)
             embed = discord.Embed(
@@ -185,7 +317,10 @@ class DriveAPICommands(discord.ext.commands.Cog, command_attrs = dict(guild_only
         else:
             
             user_current_path = DriveAPICommands._wd_cache[ctx.author.id][0]
-            folder = self.API.search(file_name=path, parent=DriveAPICommands._drive_state[user_current_path]["id"], files=False)
+            if self._is_fresh(user_current_path) and path in DriveAPICommands._drive_state[user_current_path]["folders"]:
+                folder = [{"name": path, "id": DriveAPICommands._drive_state[user_current_path / path]["id"]}]
+            else:
+                folder = await to_thread(self.API.search, file_name=path, parent=DriveAPICommands._drive_state[user_current_path]["id"], files=False)
 
             # await ctx.send_response(f"{folder}")
             
@@ -197,10 +332,9 @@ class DriveAPICommands(discord.ext.commands.Cog, command_attrs = dict(guild_only
             path, folder_id = folder[0]["name"], folder[0]["id"]
             DriveAPICommands._wd_cache[ctx.author.id][0] /= path
         
-        items = self.API.search(parent=folder_id, page_size=100, recursive=True)
-        DriveAPICommands._drive_state[DriveAPICommands._wd_cache[ctx.author.id][0]]["id"] = folder_id
-        DriveAPICommands._drive_state[DriveAPICommands._wd_cache[ctx.author.id][0]]["folders"] = [folder["name"] for folder in items if folder['mimeType'].startswith(self.API.FOLDER_TYPE)]
-        DriveAPICommands._drive_state[DriveAPICommands._wd_cache[ctx.author.id][0]]["files"] = [file["name"] for file in items if not file['mimeType'].startswith(self.API.FOLDER_TYPE)]
+        if not self._is_fresh(DriveAPICommands._wd_cache[ctx.author.id][0]):
+            await self._refresh_listing(DriveAPICommands._wd_cache[ctx.author.id][0], folder_id)
+        self._prefetch(DriveAPICommands._wd_cache[ctx.author.id][0])
         
         embed.add_field(name="", value=f"Directory changed to `{DriveAPICommands._wd_cache[ctx.author.id][0]}`", inline=True)
         await ctx.send_response(embed=embed, ephemeral=True)
@@ -211,15 +345,6 @@ class DriveAPICommands(discord.ext.commands.Cog, command_attrs = dict(guild_only
         if not await self._API_ready(ctx):
             return
         
-        def convert_size(size_bytes):
-            if size_bytes == 0:
-                return "0 B"
-            size_name = ("B", "KB", "MB", "GB", "TB", "PB", "EB", "ZB", "YB")
-            i = int(math.floor(math.log(size_bytes, 1024)))
-            p = math.pow(1024, i)
-            s = round(size_bytes / p, 2)
-            return f"{s} {size_name[i]}"
-
         def shorten_name(name: str, folder: bool):
             if folder: name = name.rsplit(".", 1)[0]
             if len(name) < 43: return name
@@ -234,12 +359,19 @@ class DriveAPICommands(discord.ext.commands.Cog, command_attrs = dict(guild_only
         
         folder_id = DriveAPICommands._drive_state[DriveAPICommands._wd_cache[ctx.author.id][0]]["id"]
         
-        items = self.API.search(parent=folder_id, files=True, page_size=100, recursive=True)
+        if not self._is_fresh(DriveAPICommands._wd_cache[ctx.author.id][0]):
+            # A stale listing is still shown if the folder cannot be listed again, but one that was never listed is not shown as empty
+            if not await self._refresh_listing(DriveAPICommands._wd_cache[ctx.author.id][0], folder_id) and not DriveAPICommands._drive_state[DriveAPICommands._wd_cache[ctx.author.id][0]]["updated"]:
+                await ctx.send_response("The contents of this folder could not be listed, please try again.", ephemeral=True)
+                return
+        self._prefetch(DriveAPICommands._wd_cache[ctx.author.id][0])
+        
+        items = DriveAPICommands._drive_state[DriveAPICommands._wd_cache[ctx.author.id][0]]["items"]
         items_per_page = 10
         
         item_icon_list = [f"{folder_type_mapping[item['mimeType'].startswith(self.API.FOLDER_TYPE)]} {shorten_name(item['name'], not item['mimeType'].startswith(self.API.FOLDER_TYPE))}" for item in items]
-        item_size_list = [convert_size(int(item['size'])) if not item['mimeType'].startswith(self.API.FOLDER_TYPE) else "--" for item in items]
-        item_kind_list = [str(guess_extension(item['mimeType']))[1:].upper() if not item['mimeType'].startswith(self.API.FOLDER_TYPE) else "Folder" for item in items]
+        item_size_list = [convert_size(int(item['size'])) if 'size' in item else "--" for item in items]
+        item_kind_list = [self._kind(item['mimeType']) for item in items]
         
         # possibly not necessary
         item_icon_list.extend([""] * (items_per_page - len(item_icon_list) % items_per_page))
@@ -265,16 +397,221 @@ class DriveAPICommands(discord.ext.commands.Cog, command_attrs = dict(guild_only
 
         await paginated_list.respond(ctx.interaction, ephemeral=True)
     
+    async def _find_results(self, query: str):
+        seen = set()
+        # Names already in the local index are instant, so show them before asking Drive
+        for item in await to_thread(self.API.search_index, query):
+            seen.add(item["id"])
+            yield item
+        page_token = ""
+        while True:
+            items, page_token = await to_thread(self.API.find, query, page_token=page_token)
+            for item in items:
+                if item["id"] not in seen:
+                    seen.add(item["id"])
+                    yield item
+            if not page_token:
+                return
+    
+    def _find_page(self, ctx: discord.ApplicationContext, query: str, items: list, user_color: discord.Colour) -> Page:
+        chains = list({tuple(item["path"]): item["path"] for item in items}.values())
+        
+        embed = discord.Embed(
+            title=f"Results for \"{query}\"",
+            color=user_color,
+        )
+        embed.set_author(name=ctx.author.name, icon_url=ctx.author.display_avatar.url)
+        embed.add_field(name="Name", value="\n".join(f"{chr(128193) if item['mimeType'] == self.API.FOLDER_TYPE else chr(128196)} {item['name'][:40]}" for item in items), inline=True)
+        embed.add_field(name="Folder", value="\n".join(f"`{pathlib.Path(*[name for name, _ in item['path']])}`"[:60] for item in items), inline=True)
+        
+        select = discord.ui.Select(
+            placeholder="Jump to a folder",
+            options=[discord.SelectOption(label=str(pathlib.Path(*[name for name, _ in chain]))[-100:], value=str(i)) for i, chain in enumerate(chains)]
+        )
+        
+        async def jump(interaction: discord.Interaction):
+            path = self._register_chain(chains[int(select.values[0])])
+            DriveAPICommands._wd_cache[interaction.user.id][1] = DriveAPICommands._wd_cache[interaction.user.id][0]
+            DriveAPICommands._wd_cache[interaction.user.id][0] = path
+            if not self._is_fresh(path):
+                await self._refresh_listing(path, DriveAPICommands._drive_state[path]["id"])
+            self._prefetch(path)
+            await interaction.response.send_message(f"Directory changed to `{path}`", ephemeral=True)
+        
+        select.callback = jump
+        view = discord.ui.View()
+        view.add_item(select)
+        return Page(embeds=[embed], custom_view=view)
+    
+    async def _find_pages(self, ctx: discord.ApplicationContext, query: str, user_color: discord.Colour, items_per_page: int = 10):
+        items = []
+        async for item in self._find_results(query):
+            items.append(item)
+            if len(items) == items_per_page:
+                yield self._find_page(ctx, query, items, user_color)
+                items = []
+        if items:
+            yield self._find_page(ctx, query, items, user_color)
+    
+    @discord.ext.commands.slash_command(name="find", description="Search the names and contents of every file in the drive")
+    async def find(self, ctx: discord.ApplicationContext, query: discord.SlashCommandOptionType.string):
+
+        if not await self._API_ready(ctx):
+            return
+        
+        await ctx.defer(ephemeral=True)
+        
+        user_color = await self._get_user_color(ctx)
+        loader = self._find_pages(ctx, query, user_color)
+        
+        # Load the first page, plus one more so the next button is enabled when there are more results
+        pages = []
+        async for page in loader:
+            pages.append(page)
+            if len(pages) == 2:
+                break
+        if not pages:
+            await ctx.send_followup(f"No files matching `{query}` were found.", ephemeral=True)
+            return
+        
+        paginated_list = _LazyPaginator(pages=pages, loader=loader if len(pages) == 2 else None)
+        await paginated_list.respond(ctx.interaction, ephemeral=True)
+    
+    async def _tree_pages(self, ctx: discord.ApplicationContext, path: pathlib.Path, folder_id: str, children: dict, user_color: discord.Colour, lines_per_page: int = 25):
+        branch, last_branch, pipe = "\u251c\u2500\u2500 ", "\u2514\u2500\u2500 ", "\u2502   "
+        
+        def lines(parent_id: str, prefix: str):
+            items = children.get(parent_id, [])
+            for i, item in enumerate(items):
+                last = i == len(items) - 1
+                folder = item['mimeType'] == self.API.FOLDER_TYPE
+                yield f"{prefix}{last_branch if last else branch}{chr(128193) if folder else chr(128196)} {item['name'][:40]}"
+                if folder:
+                    yield from lines(item["id"], prefix + ("    " if last else pipe))
+        
+        page = []
+        for line in lines(folder_id, ""):
+            page.append(line)
+            if len(page) == lines_per_page:
+                yield self._tree_page(ctx, path, page, user_color)
+                page = []
+        if page:
+            yield self._tree_page(ctx, path, page, user_color)
+    
+    def _tree_page(self, ctx: discord.ApplicationContext, path: pathlib.Path, page: list, user_color: discord.Colour) -> discord.Embed:
+        embed = discord.Embed(
+            title=f"{path.name}",
+            description="```\n" + "\n".join(page) + "\n```",
+            color=user_color,
+        )
+        embed.set_author(name=ctx.author.name, icon_url=ctx.author.display_avatar.url)
+        embed.set_footer(text=f"{path}")
+        return embed
+    
+    @discord.ext.commands.slash_command(name="tree", description="Show the folders below your current working directory")
+    async def tree(
+        self,
+        ctx: discord.ApplicationContext,
+        depth: discord.Option(int, "How many levels to show", min_value=1, max_value=6, default=2)=2, # type: ignore
+        files: discord.Option(bool, "Show files as well as folders", default=False)=False # type: ignore
+    ):
+
+        if not await self._API_ready(ctx):
+            return
+        
+        await ctx.defer(ephemeral=True)
+        
+        path = DriveAPICommands._wd_cache[ctx.author.id][0]
+        folder_id = DriveAPICommands._drive_state[path]["id"]
+        
+        # Every level is fetched with a few batched queries, no matter how many folders it has
+        children = dict()
+        paths = {folder_id: path}
+        level = [folder_id]
+        for _ in range(depth):
+            if not level:
+                break
+            if (listing := await to_thread(self.API.list_children, level, files=files)) is None:
+                await ctx.send_followup("The folder tree could not be listed.", ephemeral=True)
+                return
+            children.update(listing)
+            level = []
+            for parent_id, items in listing.items():
+                if files:
+                    self._store_listing(paths[parent_id], parent_id, items)
+                for item in items:
+                    if item['mimeType'] == self.API.FOLDER_TYPE:
+                        paths[item["id"]] = paths[parent_id] / item["name"]
+                        DriveAPICommands._drive_state[paths[item["id"]]]["id"] = item["id"]
+                        level.append(item["id"])
+        
+        user_color = await self._get_user_color(ctx)
+        loader = self._tree_pages(ctx, path, folder_id, children, user_color)
+        
+        pages = []
+        async for page in loader:
+            pages.append(page)
+            if len(pages) == 2:
+                break
+        if not pages:
+            await ctx.send_followup(f"`{path}` is empty.", ephemeral=True)
+            return
+        
+        paginated_list = _LazyPaginator(pages=pages, loader=loader if len(pages) == 2 else None)
+        await paginated_list.respond(ctx.interaction, ephemeral=True)
+    
     async def _get_files(ctx: discord.AutocompleteContext):
         return DriveAPICommands._drive_state[DriveAPICommands._wd_cache[ctx.interaction.user.id][0]]["files"]
 
+    @discord.ext.commands.slash_command(name="preview", description="Preview a file from your current working directory without downloading it")
+    async def preview(
+        self,
+        ctx: discord.ApplicationContext,
+        name: discord.Option(str, "Pick a file", autocomplete=discord.utils.basic_autocomplete(_get_files)) # type: ignore
+    ):
+
+        if not await self._API_ready(ctx):
+            return
+        
+        await ctx.defer(ephemeral=True)
+
+        folder_id = DriveAPICommands._drive_state[DriveAPICommands._wd_cache[ctx.author.id][0]]["id"]
+        file = await to_thread(self.API.preview, file_name=name, parent=folder_id)
+        
+        if isinstance(file, str):
+            await ctx.send_followup(file, ephemeral=True)
+            return
+
+        user_color = await self._get_user_color(ctx)
+        embed = discord.Embed(
+            title=f"{file['name']}",
+            description=f"{DriveAPICommands._wd_cache[ctx.author.id][0]}",
+            color=user_color,
+        )
+        
+        embed.set_author(name=ctx.author.name, icon_url=ctx.author.display_avatar.url)
+        embed.add_field(name="Kind", value=self._kind(file['mimeType']), inline=True)
+        embed.add_field(name="Size", value=convert_size(int(file['size'])) if "size" in file else "--", inline=True)
+        embed.add_field(name="Modified", value=f"<t:{int(datetime.fromisoformat(file['modifiedTime'].replace('Z', '+00:00')).timestamp())}:f>", inline=True)
+        if file.get("owners"):
+            embed.add_field(name="Owner", value=", ".join(owner["displayName"] for owner in file["owners"]), inline=True)
+
+        if file["thumbnail"] is None:
+            embed.set_footer(text="No preview is available for this file.")
+            await ctx.send_followup(embed=embed, ephemeral=True)
+            return
+
+        embed.set_image(url="attachment://preview.png")
+        await ctx.send_followup(embed=embed, file=discord.File(BytesIO(file["thumbnail"]), filename="preview.png"), ephemeral=True)
+
     @discord.ext.commands.slash_command(name="download", description="Download a file from your current working directory")
     async def download(
         self, 
         ctx: discord.ApplicationContext, 
         name: discord.Option(str, "Pick a file", autocomplete=discord.utils.basic_autocomplete(_get_files)), # type: ignore
         timeout="60",
-        public:bool=False
+        public:bool=False,
+        file_format: discord.Option(str, "Format to convert Google Docs, Sheets and Slides to", name="format", choices=list(DriveAPI.EXPORT_FORMATS), default="PDF")="PDF" # type: ignore
     ):
 
         if not await self._API_ready(ctx):
@@ -283,11 +620,14 @@ class DriveAPICommands(discord.ext.commands.Cog, command_attrs = dict(guild_only
         timeout = float(timeout)
         await ctx.response.defer(ephemeral=(not public))
 
-        folder_id = DriveAPICommands._drive_state[DriveAPICommands._wd_cache[ctx.author.id][0]]["id"]
-        file = self.API.export(file_name=name, parent=folder_id, limit=ctx.guild.filesize_limit)
+        user_color = await self._get_user_color(ctx)
 
+        folder_id = DriveAPICommands._drive_state[DriveAPICommands._wd_cache[ctx.author.id][0]]["id"]
+        file = await to_thread(self.API.export, file_name=name, parent=folder_id, limit=ctx.guild.filesize_limit, export_format=file_format)
+        if isinstance(file, str) and not isinstance(file, SharedLink):
+            await ctx.send_followup(file, ephemeral=True)
+            return
 
-        user_color = await self._get_user_color(ctx)
         embed = discord.Embed(
             title=f"{name} download",
             description=f"{DriveAPICommands._wd_cache[ctx.author.id][0]}",
@@ -297,25 +637,28 @@ class DriveAPICommands(discord.ext.commands.Cog, command_attrs = dict(guild_only
         embed.set_author(name=ctx.author.name, icon_url=ctx.author.display_avatar.url)
 
 
-        if isinstance(file, str):
+        if isinstance(file, SharedLink):
             embed.add_field(name="Click below for your file!", value=f"{file}\nLink expires {('<t:' + str(int(time() + timeout)) + ':R>') if timeout != float('inf') else 'never'}.", inline=True)
-            if timeout != float("inf"):
-                await ctx.send_followup(embed=embed, delete_after=timeout)
-                await sleep(timeout)
-                self.API.revoke_sharing(file[file.index("file/d/")+7:-19])
-            else:
-                await ctx.send_followup(embed=embed)
-        else:
-            @DriveAPI._temp_dir_async("temp")
-            async def send_file():
-                embed.add_field(name="Download the attached file!", value=f"File expires {('<t:' + str(int(time() + timeout)) + ':R>') if timeout != float('inf') else 'never'}.", inline=True)
+            # The link is shared with other requests, so it must be released even if sending fails
+            try:
                 if timeout != float("inf"):
-                    await ctx.send_followup(embed=embed, file=file, delete_after=timeout)
+                    await ctx.send_followup(embed=embed, delete_after=timeout)
+                    await sleep(timeout)
                 else:
-                    await ctx.send_followup(embed=embed, file=file)
-                file.close()
-
-            await send_file()
+                    await ctx.send_followup(embed=embed)
+            except BaseException:
+                self._release_link(file.file_id)
+                raise
+            if timeout != float("inf"):
+                self._release_link(file.file_id)
+        else:
+            # The file is held in memory, so there is no temporary directory to clean up, and clearing one here could remove another command's upload
+            embed.add_field(name="Download the attached file!", value=f"File expires {('<t:' + str(int(time() + timeout)) + ':R>') if timeout != float('inf') else 'never'}.", inline=True)
+            if timeout != float("inf"):
+                await ctx.send_followup(embed=embed, file=file, delete_after=timeout)
+            else:
+                await ctx.send_followup(embed=embed, file=file)
+            file.close()
                 
     @discord.ext.commands.slash_command(name="share", description="Share a file from your current working directory")
     async def share(
@@ -323,7 +666,8 @@ class DriveAPICommands(discord.ext.commands.Cog, command_attrs = dict(guild_only
         ctx: discord.ApplicationContext, 
         name: discord.Option(str, "Pick a file", autocomplete=discord.utils.basic_autocomplete(_get_files)), # type: ignore
         user: discord.SlashCommandOptionType.user,
-        timeout="60"
+        timeout="60",
+        file_format: discord.Option(str, "Format to convert Google Docs, Sheets and Slides to", name="format", choices=list(DriveAPI.EXPORT_FORMATS), default="PDF")="PDF" # type: ignore
     ):
         
         if not await self._API_ready(ctx):
@@ -332,10 +676,14 @@ class DriveAPICommands(discord.ext.commands.Cog, command_attrs = dict(guild_only
         timeout = float(timeout)
         await ctx.response.defer(ephemeral=True)
 
+        user_color = await self._get_user_color(ctx)
+
         folder_id = DriveAPICommands._drive_state[DriveAPICommands._wd_cache[ctx.author.id][0]]["id"]
-        file = self.API.export(file_name=name, parent=folder_id, limit=ctx.guild.filesize_limit)
+        file = await to_thread(self.API.export, file_name=name, parent=folder_id, limit=ctx.guild.filesize_limit, export_format=file_format)
+        if isinstance(file, str) and not isinstance(file, SharedLink):
+            await ctx.send_followup(file, ephemeral=True)
+            return
 
-        user_color = await self._get_user_color(ctx)
         embed = discord.Embed(
             title=f"{name} has been shared with you!",
             description=f"From: {DriveAPICommands._wd_cache[ctx.author.id][0]}",
@@ -352,21 +700,27 @@ class DriveAPICommands(discord.ext.commands.Cog, command_attrs = dict(guild_only
         embed2.set_author(name=ctx.author.name, icon_url=ctx.author.display_avatar.url)
         embed2.add_field(name="", value=f"File shared with {user.mention}!", inline=True)
 
-        await ctx.send_followup(embed=embed2, ephemeral=True)
-
-        if isinstance(file, str):
+        if isinstance(file, SharedLink):
 
             embed.add_field(name="Click below for your file!", value=f"{file}\nLink expires {('<t:' + str(int(time() + timeout)) + ':R>') if timeout != float('inf') else 'never'}.", inline=True)
             
+            # The link is shared with other requests, so it must be released even if sending fails
+            try:
+                await ctx.send_followup(embed=embed2, ephemeral=True)
+                if timeout != float("inf"):
+                    # await user.send(embed=embed, ephemeral=True, delete_after=timeout)
+                    await user.send(embed=embed, delete_after=timeout)
+                    await sleep(timeout)
+                else:
+                    # await user.send(embed=embed, ephemeral=True)
+                    await user.send(embed=embed)
+            except BaseException:
+                self._release_link(file.file_id)
+                raise
             if timeout != float("inf"):
-                # await user.send(embed=embed, ephemeral=True, delete_after=timeout)
-                await user.send(embed=embed, delete_after=timeout)
-                await sleep(timeout)
-                self.API.revoke_sharing(file[file.index("file/d/")+7:-19])
-            else:
-                # await user.send(embed=embed, ephemeral=True)
-                await user.send(embed=embed)
+                self._release_link(file.file_id)
         else:
+            await ctx.send_followup(embed=embed2, ephemeral=True)
             
             embed.add_field(name="Download the attached file!", value=f"File expires {('<t:' + str(int(time() + timeout)) + ':R>') if timeout != float('inf') else 'never'}.", inline=True)
             if timeout != float("inf"):
@@ -378,6 +732,48 @@ class DriveAPICommands(discord.ext.commands.Cog, command_attrs = dict(guild_only
             empty_dir("temp")
         
     
+    @discord.ext.commands.slash_command(name="du", description="Show how much space your current working directory uses")
+    async def du(self, ctx: discord.ApplicationContext):
+
+        if not await self._API_ready(ctx):
+            return
+        
+        await ctx.defer(ephemeral=True)
+        
+        path = DriveAPICommands._wd_cache[ctx.author.id][0]
+        folder_id = DriveAPICommands._drive_state[path]["id"]
+        
+        # Only the first call has to index the whole tree, so keep it off the event loop
+        size = await to_thread(self.API.disk_usage, folder_id)
+        quota = await to_thread(self.API.quota)
+        
+        user_color = await self._get_user_color(ctx)
+        embed = discord.Embed(
+            title="Disk Usage",
+            description=f"{path}",
+            color=user_color,
+        )
+        embed.set_author(name=ctx.author.name, icon_url=ctx.author.display_avatar.url)
+        
+        if size is None:
+            embed.add_field(name="", value="The size of this folder could not be found.", inline=False)
+        else:
+            embed.add_field(name="This folder", value=convert_size(size), inline=True)
+            
+            children = sorted(
+                ((name, self.API.sizes.get(DriveAPICommands._drive_state[path / name]["id"], 0)) for name in DriveAPICommands._drive_state[path]["folders"]),
+                key=lambda child: -child[1]
+            )
+            if children:
+                embed.add_field(name="Largest folders", value="\n".join(f"{chr(128193)} {name[:40]}: {convert_size(child_size)}" for name, child_size in children[:10]), inline=False)
+        
+        if quota:
+            limit = f"{convert_size(int(quota['limit']))}" if "limit" in quota else "unlimited"
+            embed.add_field(name="Drive", value=f"{convert_size(int(quota['usage']))} of {limit} used", inline=True)
+            embed.add_field(name="Trash", value=convert_size(int(quota.get("usageInDriveTrash", 0))), inline=True)
+        
+        await ctx.send_followup(embed=embed, ephemeral=True)
+    
     @discord.ext.commands.slash_command(name="mkdir", description="Make a new folder in your current working directory")
     @has_permissions(administrator=True)
     async def mkdir(self, ctx: discord.ApplicationContext, folder_name: discord.SlashCommandOptionType.string):
@@ -403,11 +799,47 @@ class DriveAPICommands(discord.ext.commands.Cog, command_attrs = dict(guild_only
             folders = self.API.search(parent=parent_id, files=False, page_size=100, recursive=True)
             DriveAPICommands._drive_state[DriveAPICommands._wd_cache[ctx.author.id][0]]["id"] = parent_id
             DriveAPICommands._drive_state[DriveAPICommands._wd_cache[ctx.author.id][0]]["folders"] = [folder["name"] for folder in folders]
+            DriveAPICommands._drive_state[DriveAPICommands._wd_cache[ctx.author.id][0]]["updated"] = 0
             
         else:
             embed.add_field(name="", value="Could not create folder.", inline=True)
             await ctx.send_response(embed=embed)
     
+    @discord.ext.commands.slash_command(name="diagnostics", description="Show event loop stalls and the commands that caused them")
+    @has_permissions(administrator=True)
+    async def diagnostics(self, ctx: discord.ApplicationContext):
+        self.watchdog.start(get_running_loop())
+        
+        stalls = list(self.watchdog.stalls)
+        
+        embed = discord.Embed(
+            title="Diagnostics",
+            color=await self._get_user_color(ctx),
+        )
+        embed.set_author(name=ctx.author.name, icon_url=ctx.author.display_avatar.url)
+        embed.add_field(name="Loop lag", value=f"{self.watchdog.lag * 1000:.0f} ms (max {self.watchdog.max_lag * 1000:.0f} ms)", inline=True)
+        embed.add_field(name="Stalls", value=f"{len(stalls)} over {self.watchdog.threshold * 1000:.0f} ms", inline=True)
+        
+        if stalls:
+            blame = defaultdict(lambda: [0, 0])
+            for stall in stalls:
+                blame[(stall["command"], stall["method"])][0] += 1
+                blame[(stall["command"], stall["method"])][1] += stall["duration"]
+            embed.add_field(
+                name="Blocked by",
+                value="\n".join(f"`/{command}` in `{method}`: {n}x, {total:.2f}s" for (command, method), (n, total) in sorted(blame.items(), key=lambda item: -item[1][1])[:10]),
+                inline=False
+            )
+            
+            latest = stalls[-1]
+            embed.add_field(
+                name=f"Latest: /{latest['command']} ({latest['duration']:.2f}s, <t:{int(latest['time'].timestamp())}:R>)",
+                value=f"```{''.join(latest['stack'][-4:])[-1000:]}```",
+                inline=False
+            )
+        
+        await ctx.send_response(embed=embed, ephemeral=True)
+    
     @discord.ext.commands.slash_command(name="authenticate", description="Authenticate your google account")
     @has_permissions(administrator=True)
     async def authenticate(self, ctx: discord.ApplicationContext):
@@ -466,10 +898,7 @@ class DriveAPICommands(discord.ext.commands.Cog, command_attrs = dict(guild_only
         await response.edit(embed=embed)
         
         if self.API.service is not None:
-            items = self.API.search(parent=self.API.ROOT_ID, page_size=100, recursive=True)
-            DriveAPICommands._drive_state[self.root_path]["id"] = self.API.ROOT_ID
-            DriveAPICommands._drive_state[self.root_path]["folders"] = [folder["name"] for folder in items if folder['mimeType'].startswith(self.API.FOLDER_TYPE)]
-            DriveAPICommands._drive_state[self.root_path]["files"] = [file["name"] for file in items if not file['mimeType'].startswith(self.API.FOLDER_TYPE)]
+            await self._refresh_listing(self.root_path, self.API.ROOT_ID)
     
     @discord.ext.commands.slash_command(name="discord_drive_commands", description="Show all useable commands")
     async def help(self, ctx: discord.ApplicationContext):
@@ -480,7 +909,7 @@ class DriveAPICommands(discord.ext.commands.Cog, command_attrs = dict(guild_only
         )
         
         embed.set_author(name=ctx.author.name, icon_url=ctx.author.display_avatar.url)
-        for text in "`/authenticate`: Regenerates the token needed to enable the API. If re-authentication is needed, the bot will DM the caller a link and wait for the authentication code given to the caller by Google\n`/cd <directory>`: Navigates the caller down into a child directory of their current directory. Autocomplete is provided for hints.\n`/download <file> <timeout (optional)> <public (optional)>`: Gives the user the file (or a link) to download the file specified. Files have autocomplete. Timeout defaults to 60 seconds, where the file will then no longer be allowed to be downloaded. Public defaults to False, where no other users can see the file.\n`/ls`: Shows the caller the contents of their current directory.\n`/pwd`: Shows the caller the file path of their current directory.\n`/share <file> <user> <timeout (optional)>`: Sends a specified server member a dm with a file from the caller's current directory. Files and users have autocomplete. Timeout defaults to 60 seconds, where the file will then no longer be allowed to be downloaded.\n`/upload <attachment>`: Uploads a file or zip file to the caller's current directory. Zip files must contain just the files, and no folders, as they will not be read.".split("\n"):
+        for text in "`/authenticate`: Regenerates the token needed to enable the API. If re-authentication is needed, the bot will DM the caller a link and wait for the authentication code given to the caller by Google\n`/cd <directory>`: Navigates the caller down into a child directory of their current directory. Autocomplete is provided for hints.\n`/diagnostics`: Shows administrators how long the bot has been blocked by slow work, which commands and Google Drive calls caused it, and where the latest stall happened.\n`/download <file> <timeout (optional)> <public (optional)> <format (optional)>`: Gives the user the file (or a link) to download the file specified. Files have autocomplete. Timeout defaults to 60 seconds, where the file will then no longer be allowed to be downloaded. Public defaults to False, where no other users can see the file. Google Docs, Sheets and Slides are converted to the chosen format, which defaults to PDF.\n`/du`: Shows the caller how much space their current directory and its largest folders use, along with the space used in the Google Drive account.\n`/find <query>`: Searches the names and contents of every file under the root. Results load page by page, and the menu below each page moves the caller straight to the folder containing a result.\n`/ls`: Shows the caller the contents of their current directory.\n`/preview <file>`: Shows the caller a thumbnail and the details of a file from their current directory without downloading it. Files have autocomplete.\n`/pwd`: Shows the caller the file path of their current directory.\n`/share <file> <user> <timeout (optional)> <format (optional)>`: Sends a specified server member a dm with a file from the caller's current directory. Files and users have autocomplete. Timeout defaults to 60 seconds, where the file will then no longer be allowed to be downloaded. Google Docs, Sheets and Slides are converted to the chosen format, which defaults to PDF.\n`/tree <depth (optional)> <files (optional)>`: Shows the caller the folders below their current directory, and their files if requested. Depth defaults to 2 levels.\n`/upload <attachment>`: Uploads a file or zip file to the caller's current directory. Zip files must contain just the files, and no folders, as they will not be read.".split("\n"):
             embed.add_field(name="", value=text, inline=False)
         await ctx.send_response(embed=embed)
         
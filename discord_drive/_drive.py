@@ -1,27 +1,87 @@
 from inspect import getfullargspec
 
-from google.auth.transport.requests import Request
+from google.auth.transport.requests import AuthorizedSession, Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+from httplib2 import Http
+from requests import RequestException
 
 from discord import Attachment, File, ApplicationContext, Client, Message, DMChannel, Embed
 from zipfile import ZipFile, BadZipFile
 from mimetypes import guess_type
 from io import BytesIO, open
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import local, Event, Lock
+from time import time
 
 from ._utils import *
 
+class SharedLink(str):
+
+    def __new__(cls, file_id:str, file_name:str, url:str):
+        """A markdown link to a file shared with share_link, told apart from the plain messages export returns.
+
+        Args:
+            file_id (str): ID of the shared file, to pass to release_link.
+            file_name (str): Name to show for the link.
+            url (str): Where the link points.
+        """
+        link = super().__new__(cls, f'[{file_name}](<{url}>)')
+        link.file_id = file_id
+        return link
+
 class DriveAPI:
     ROOT = ""
     ROOT_ID = ""
     
     folders = dict()
+    index = dict()
+    index_lock = Lock()
+
+    sizes = None
+    tree_folders = None
+    changes_token = None
+    about = None
+    ABOUT_TTL = 300
 
     service = None
+    session = None
+    creds = None
+    threads = local()
+
+    thumbnails = OrderedDict()
+    THUMBNAIL_CACHE_SIZE = 32
+    THUMBNAIL_TIMEOUT = 5
+    thumbnails_lock = Lock()
+
+    exports = OrderedDict()
+    EXPORT_CACHE_SIZE = 8
+    exports_lock = Lock()
+
+    NATIVE_TYPE = "application/vnd.google-apps."
+    EXPORT_FORMATS = {
+        "PDF": "application/pdf",
+        "DOCX": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        "XLSX": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "PPTX": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+        "CSV": "text/csv",
+        "TXT": "text/plain",
+        "PNG": "image/png"
+    }
+
+    links = dict()
+    links_lock = Lock()
+
+    flights = dict()
+    recent = dict()
+    flights_lock = Lock()
+    RECENT_TTL = 2
+    FLIGHT_TIMEOUT = 30
 
     FOLDER_TYPE = "application/vnd.google-apps.folder"
     SCOPES = ["https://www.googleapis.com/auth/drive", "https://www.googleapis.com/auth/drive.activity", "https://www.googleapis.com/auth/drive.metadata"]
@@ -147,7 +207,9 @@ class DriveAPI:
     @_input_validator
     def create_service(self, creds: Credentials):
         try:
+            self.creds = creds
             self.service = build("drive", "v3", credentials=creds)
+            self.session = AuthorizedSession(creds)
 
             folder = self.service.files().get(fileId=self.ROOT_ID).execute()
             
@@ -162,14 +224,293 @@ class DriveAPI:
             print(f"An error occurred: {error}")
 
 
+    def _http(self) -> AuthorizedHttp:
+        """Returns an authorized http object for the current thread, since the one shared by the service is not thread safe.
+        """
+        if getattr(self.threads, "creds", None) is not self.creds:
+            self.threads.creds = self.creds
+            self.threads.http = AuthorizedHttp(self.creds, http=Http())
+        return self.threads.http
+
+    def _list(self, **kwargs) -> dict:
+        """Runs a files.list request, sharing the response between identical requests.
+        A request made while an identical one is in flight waits for its response instead of being sent,
+        and responses are reused for RECENT_TTL seconds afterwards. A caller that has waited FLIGHT_TIMEOUT seconds sends its own request.
+
+        Raises:
+            Exception: Whatever the request failed with, for every caller waiting on it
+        """
+        key = tuple(sorted(kwargs.items()))
+
+        with self.flights_lock:
+            if key in self.recent and time() - self.recent[key][0] < self.RECENT_TTL:
+                return self.recent[key][1]
+            leader = key not in self.flights
+            if leader:
+                self.flights[key] = {"done": Event(), "results": None, "error": None}
+            flight = self.flights[key]
+
+        if not leader:
+            if not flight["done"].wait(self.FLIGHT_TIMEOUT):
+                return self.service.files().list(**kwargs).execute(http=self._http())
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["results"]
+
+        try:
+            flight["results"] = self.service.files().list(**kwargs).execute(http=self._http())
+            with self.flights_lock:
+                now = time()
+                for old in [old for old, (created, _) in self.recent.items() if now - created >= self.RECENT_TTL]:
+                    del self.recent[old]
+                self.recent[key] = (now, flight["results"])
+            return flight["results"]
+        except BaseException as error:
+            flight["error"] = error
+            raise
+        finally:
+            with self.flights_lock:
+                del self.flights[key]
+            flight["done"].set()
+
     @_input_validator
     def update_folders(self, flist:list) -> None:
         for file in flist:
+            entry = {
+                "name": file["name"],
+                "mimeType": file["mimeType"],
+                "parent": file.get("parents", [""])[0],
+                "size": file.get("size")
+            }
+            with self.index_lock:
+                if self.sizes is not None:
+                    self._move(file["id"], entry)
+                if self.tree_folders is not None and file["mimeType"] == self.FOLDER_TYPE and entry["parent"] in self.tree_folders:
+                    self.tree_folders.add(file["id"])
+                self.index[file["id"]] = entry
             if file["mimeType"] == self.FOLDER_TYPE:
                 self.folders[file["name"]] = file["id"]
+
+    def _weight(self, file_id:str, entry:dict) -> int:
+        if entry["mimeType"] == self.FOLDER_TYPE:
+            return self.sizes.get(file_id, 0)
+        return int(entry["size"] or 0)
+
+    def _resize(self, folder_id:str, delta:int):
+        """Adds a change in size to a folder and every folder above it, up to the root.
+        """
+        while folder_id in self.sizes:
+            self.sizes[folder_id] += delta
+            if folder_id == self.ROOT_ID:
+                return
+            folder_id = self.index[folder_id]["parent"] if folder_id in self.index else None
+
+    def _move(self, file_id:str, entry:dict):
+        """Keeps the folder sizes in step with a file or folder whose index entry is about to change.
+        An entry of None means the file was removed.
+        """
+        if (old := self.index.get(file_id)) is not None:
+            self._resize(old["parent"], -self._weight(file_id, old))
+        if entry is not None:
+            if entry["mimeType"] == self.FOLDER_TYPE and entry["parent"] in self.sizes:
+                self.sizes.setdefault(file_id, 0)
+            self._resize(entry["parent"], self._weight(file_id, entry))
+
+    def build_tree(self) -> bool:
+        """Indexes every file under the root and adds their sizes up into every folder above them.
+        Changes made after this are picked up by sync_changes.
+
+        Returns:
+            bool: Whether the tree was built, False if part of it could not be listed.
+        """
+        self.changes_token = self.service.changes().getStartPageToken().execute(http=self._http())["startPageToken"]
+
+        sizes = {self.ROOT_ID: 0}
+        files = []
+        level = [self.ROOT_ID]
+        while level:
+            if (children := self.list_children(level)) is None:
+                return False
+            level = []
+            for item in {item["id"]: item for items in children.values() for item in items}.values():
+                if item["mimeType"] == self.FOLDER_TYPE:
+                    sizes[item["id"]] = 0
+                    level.append(item["id"])
+                else:
+                    files.append(item)
+
+        with self.index_lock:
+            self.sizes = sizes
+            for file in files:
+                self._resize(self.index[file["id"]]["parent"], self._weight(file["id"], self.index[file["id"]]))
+        return True
+
+    def sync_changes(self):
+        """Applies every change made to the drive since the last sync to the index and the folder sizes.
+        """
+        page_token = self.changes_token
+        while page_token:
+            results = (
+                self.service.changes()
+                .list(pageToken=page_token,
+                    pageSize=1000,
+                    fields="nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, mimeType, size, parents, trashed))")
+                .execute(http=self._http())
+            )
+            for change in results.get("changes", []):
+                file = change.get("file")
+                if change.get("removed") or file is None or file.get("trashed"):
+                    with self.index_lock:
+                        self._move(change["fileId"], None)
+                        self.index.pop(change["fileId"], None)
+                # Only follow files that are, or were, inside the root
+                elif file["id"] in self.index or file.get("parents", [""])[0] in self.sizes:
+                    self.update_folders([file])
+            page_token = results.get("nextPageToken")
+            self.changes_token = results.get("newStartPageToken", self.changes_token)
+
+    @_input_validator
+    def disk_usage(self, folder_id:str) -> int:
+        """Finds the total size of every file under a folder. The first call indexes the whole tree,
+        later ones only fetch the changes made since the previous call.
+
+        Args:
+            folder_id (str): ID of the folder.
+
+        Returns:
+            int: Size of the folder in bytes, or None if it is not inside the root.
+        """
+        try:
+            if self.sizes is None:
+                self.build_tree()
+            else:
+                self.sync_changes()
+        except HttpError as error:
+            print(f"An error occurred: {error}")
+        if self.sizes is None:
+            return None
+        return self.sizes.get(folder_id)
+
+    def quota(self) -> dict:
+        """Returns the account's storage quota, fetched at most once every ABOUT_TTL seconds.
+
+        Returns:
+            dict: Drive's storageQuota, with 'limit' (missing if unlimited), 'usage', 'usageInDrive' and 'usageInDriveTrash' in bytes.
+        """
+        if self.about is None or time() - self.about[0] >= self.ABOUT_TTL:
+            try:
+                self.about = (time(), self.service.about().get(fields="storageQuota").execute(http=self._http())["storageQuota"])
+            except HttpError as error:
+                print(f"An error occurred: {error}")
+                return self.about[1] if self.about else {}
+        return self.about[1]
+
+    @_input_validator
+    def path_of(self, file_id:str, max_depth:int=32) -> list:
+        """Walks the parents of a file up to the root folder using the local index, fetching any folder that has not been seen yet.
+
+        Args:
+            file_id (str): ID of the file to locate.
+            max_depth (int, optional): Maximum number of parents to walk. Defaults to 32.
+
+        Returns:
+            list(tuple): (name, id) of every folder from the root down to the file's parent, or None if the file is not inside the root.
+        """
+        chain = []
+        parent = self.index.get(file_id, {}).get("parent")
+        while parent and len(chain) < max_depth:
+            if parent == self.ROOT_ID:
+                chain.append((self.ROOT, self.ROOT_ID))
+                return chain[::-1]
+            if parent not in self.index:
+                try:
+                    folder = self.service.files().get(fileId=parent, fields="id, name, mimeType, parents").execute(http=self._http())
+                except HttpError:
+                    return None
+                self.update_folders([folder])
+            chain.append((self.index[parent]["name"], parent))
+            parent = self.index[parent]["parent"]
+        return None
+
+    @_input_validator
+    def search_index(self, query:str) -> list:
+        """Finds every indexed file or folder inside the root whose name contains the query, without calling the API.
+
+        Args:
+            query (str): Text to look for, case insensitive.
+
+        Returns:
+            list(dict): The matching files, with their 'path' as given by path_of.
+        """
+        query = query.casefold()
+        found = []
+        for file_id, file in list(self.index.items()):
+            if query in file["name"].casefold() and (path := self.path_of(file_id)) is not None:
+                found.append({"id": file_id, "name": file["name"], "mimeType": file["mimeType"], "size": file["size"], "path": path})
+        return found
+
+    @_input_validator
+    def crawl_folders(self) -> set:
+        """Lists every folder under the root the first time it is called. Folders seen by update_folders afterwards are added as they appear.
+
+        Returns:
+            set(str): IDs of the root and every folder under it, or None if the folders could not be listed.
+        """
+        if self.tree_folders is None:
+            folders = {self.ROOT_ID}
+            level = [self.ROOT_ID]
+            while level:
+                if (children := self.list_children(level, files=False)) is None:
+                    return None
+                level = list({item["id"] for items in children.values() for item in items} - folders)
+                folders.update(level)
+            self.tree_folders = folders
+        return self.tree_folders
+
+    @_input_validator
+    def find(self, query:str, page_size:int=25, page_token:str='', batch_size:int=40) -> tuple:
+        """Searches the names and contents of every file under the root.
+        Drive cannot restrict a query to every descendant of a folder, so the folders of the tree are combined into 'in parents' clauses, one batch per query.
+
+        Args:
+            query (str): Text to look for in names and contents.
+            page_size (int, optional): Number of results to request. Defaults to 25.
+            page_token (str, optional): Token for the next page of results. Defaults to ''.
+            batch_size (int, optional): Number of folders combined into each query. Defaults to 40.
+
+        Returns:
+            tuple(list(dict), str): The files found, with their 'path' as given by path_of, and the token for the next page ('' if there is none).
+        """
+        if (folders := self.crawl_folders()) is None:
+            return [], ""
+        folders = sorted(folders)
+
+        # The token holds the batch of folders being searched and Drive's token within that batch
+        batch, _, drive_token = page_token.partition(":")
+        batch = int(batch or 0)
+        parentScript = " or ".join(f"'{parent}' in parents" for parent in folders[batch * batch_size:(batch + 1) * batch_size])
+
+        query = query.replace("\\", "\\\\").replace("'", "\\'")
+        try:
+            results = self._list(pageSize=page_size,
+                pageToken=drive_token,
+                q=f"trashed = false and (name contains '{query}' or fullText contains '{query}') and ({parentScript}) and mimeType!='application/vnd.google-apps.shortcut'",
+                fields="nextPageToken, files(id, name, mimeType, size, parents)")
+        except HttpError as error:
+            print(f"An error occurred: {error}")
+            return [], ""
+        foundfiles = results.get("files", [])
+        self.update_folders(foundfiles)
+        found = [dict(file, path=path) for file in foundfiles if (path := self.path_of(file["id"])) is not None]
+
+        if (drive_token := results.get("nextPageToken", "")):
+            return found, f"{batch}:{drive_token}"
+        if (batch + 1) * batch_size < len(folders):
+            return found, f"{batch + 1}:"
+        return found, ""
     
     @_input_validator
-    def search(self, file_name:str='', parent:str='', page_size:int=1, files:bool=True, folders:bool=True, page_token:str='', recursive:bool=False) -> list:
+    def search(self, file_name:str='', parent:str='', page_size:int=1, files:bool=True, folders:bool=True, page_token:str='', recursive:bool=False, fields:str='id, name, mimeType, size, parents') -> list:
         """Modular search function that can find files and folders, with the option of a specified parent directory.
 
         Args:
@@ -180,6 +521,7 @@ class DriveAPI:
             folders (bool, optional): Enable searching for folders. Defaults to True.
             pageToken (str, optional): Token for the next page of results. Defaults to ''.
             recursive (bool, optional): Search all pages for all results. Defaults to False.
+            fields (str, optional): Fields to return for each file. Defaults to 'id, name, mimeType, size, parents'.
 
         Raises:
             Exception: Any input parameters are None
@@ -210,24 +552,66 @@ class DriveAPI:
             mimeScript = f"and mimeType='{self.FOLDER_TYPE}'"
 
         try:
-            results = (
-                self.service.files()
-                .list(pageSize=page_size, 
-                    pageToken=page_token, 
-                    q=f"trashed = false{mimeScript}{nameScript}{parentScript} and mimeType!='application/vnd.google-apps.shortcut'",
-                    orderBy="folder, name", 
-                    fields="nextPageToken, files(id, name, mimeType, size)")
-                .execute()
-            )
-            foundfiles = results.get("files", [])
+            results = self._list(pageSize=page_size, 
+                pageToken=page_token, 
+                q=f"trashed = false{mimeScript}{nameScript}{parentScript} and mimeType!='application/vnd.google-apps.shortcut'",
+                orderBy="folder, name", 
+                fields=f"nextPageToken, files({fields})")
+            foundfiles = list(results.get("files", []))
             self.update_folders(foundfiles)
             if (page_token := results.get("nextPageToken", "")) and recursive:
-                return foundfiles + self.search(file_name=file_name, page_size=page_size, parent=parent, files=files, folders=folders, page_token=page_token, recursive=recursive)
+                return foundfiles + self.search(file_name=file_name, page_size=page_size, parent=parent, files=files, folders=folders, page_token=page_token, recursive=recursive, fields=fields)
             return foundfiles
         except HttpError as error:
             print(f"An error occurred: {error}")
             return None
 
+    @_input_validator
+    def list_children(self, parent_ids:list, files:bool=True, batch_size:int=40, workers:int=4) -> dict:
+        """Lists the contents of many folders at once. Folders are combined into one query per batch,
+        and the batches are fetched in parallel.
+
+        Args:
+            parent_ids (list): IDs of the folders to list.
+            files (bool, optional): Include files as well as folders. Defaults to True.
+            batch_size (int, optional): Number of folders combined into each query. Defaults to 40.
+            workers (int, optional): Number of queries run at the same time. Defaults to 4.
+
+        Returns:
+            dict(str, list(dict)): The contents of each folder, in the same format as search, or None if a query failed.
+        """
+        mimeScript = "" if files else f" and mimeType='{self.FOLDER_TYPE}'"
+
+        def fetch(batch):
+            parentScript = " or ".join(f"'{parent}' in parents" for parent in batch)
+            found = []
+            page_token = ""
+            while True:
+                results = self._list(pageSize=1000,
+                    pageToken=page_token,
+                    q=f"trashed = false{mimeScript} and ({parentScript}) and mimeType!='application/vnd.google-apps.shortcut'",
+                    orderBy="folder, name",
+                    fields="nextPageToken, files(id, name, mimeType, size, parents)")
+                found += results.get("files", [])
+                if not (page_token := results.get("nextPageToken", "")):
+                    return found
+
+        batches = [parent_ids[i:i + batch_size] for i in range(0, len(parent_ids), batch_size)]
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                foundfiles = [file for batch in pool.map(fetch, batches) for file in batch]
+        except HttpError as error:
+            print(f"An error occurred: {error}")
+            return None
+        self.update_folders(foundfiles)
+
+        children = {parent: [] for parent in parent_ids}
+        for file in foundfiles:
+            for parent in file.get("parents", []):
+                if parent in children:
+                    children[parent].append(file)
+        return children
+
     @_temp_dir_async("temp")
     @_input_validator
     async def upload_from_discord(self, file:Attachment, parent:str=""):
@@ -264,9 +648,13 @@ class DriveAPI:
         try:
             file = (
                 self.service.files()
-                .create(body=file_metadata, media_body=media, fields="name")
+                .create(body=file_metadata, media_body=media, fields="id, name, mimeType, size, parents")
                 .execute()
             )
+            with self.flights_lock:
+                self.recent.clear()
+            if {"id", "name", "mimeType", "parents"} <= file.keys():
+                self.update_folders([file])
             return file["name"]
         except HttpError as error:
             print(f"An error occurred: {error}")
@@ -285,63 +673,209 @@ class DriveAPI:
         try:
             file = (
                 self.service.files()
-                .create(body=file_metadata, fields="id")
+                .create(body=file_metadata, fields="id, name, mimeType, parents")
                 .execute()
             )
-            self.folders[file_name] = file["id"]
+            self.update_folders([file])
+            with self.flights_lock:
+                self.recent.clear()
             return True
         except HttpError:
             return False
     
-    @_temp_dir("temp")
     @_input_validator
-    def export(self, file_name:str, parent:str="", limit:int=8388608):
+    def preview(self, file_name:str, parent:str=""):
+        """Finds the metadata and thumbnail of a file without downloading any of its content.
+        Thumbnails are kept in a small LRU cache keyed by the file's id and modification time.
+
+        Args:
+            file_name (str): Name of the file to preview.
+            parent (str, optional): ID of the folder containing the file. Defaults to the root.
+
+        Returns:
+            dict: The file's metadata, with the thumbnail's bytes under 'thumbnail' (None if Drive has no thumbnail), or a message if the file was not found.
+        """
+        if not parent:
+            parent = self.ROOT_ID
+        
+        file = self.search(file_name=file_name, parent=parent, folders=False, fields="id, name, mimeType, size, parents, modifiedTime, thumbnailLink, owners(displayName)")
+        if not file:
+            return "File not found."
+        file = file[0]
+
+        key = (file["id"], file["modifiedTime"])
+        with self.thumbnails_lock:
+            if (thumbnail := self.thumbnails.get(key)) is not None:
+                self.thumbnails.move_to_end(key)
+                return dict(file, thumbnail=thumbnail)
+
+        if "thumbnailLink" not in file:
+            return dict(file, thumbnail=None)
+        try:
+            response = self.session.get(file["thumbnailLink"], timeout=self.THUMBNAIL_TIMEOUT)
+        except RequestException:
+            return dict(file, thumbnail=None)
+        if not response.ok:
+            return dict(file, thumbnail=None)
+
+        with self.thumbnails_lock:
+            self.thumbnails[key] = response.content
+            if len(self.thumbnails) > self.THUMBNAIL_CACHE_SIZE:
+                self.thumbnails.popitem(last=False)
+        return dict(file, thumbnail=response.content)
+
+    @_input_validator
+    def export(self, file_name:str, parent:str="", limit:int=8388608, export_format:str="PDF"):
         if not parent:
             parent = self.ROOT
         
-        file = self.search(file_name=file_name, parent=parent, folders=False)
+        file = self.search(file_name=file_name, parent=parent, folders=False, fields="id, name, mimeType, size, parents, modifiedTime, exportLinks")
         if not file:
             return "File not found."
 
         file_id = file[0]["id"]
 
-        if int(file[0]['size']) >= limit:
-            permissions = {
-                'type': 'anyone',
-                'role': 'reader',
-                "expirationTime": (datetime.now() + timedelta(minutes=2)).astimezone().isoformat()
-            }
-            
-            self.service.permissions().create(fileId=file_id, body=permissions).execute()
+        # Google Docs, Sheets and Slides have no content of their own, so they are converted instead of downloaded
+        if file[0]["mimeType"].startswith(self.NATIVE_TYPE):
+            content = self.convert(file[0], export_format, limit)
+            if isinstance(content, str):
+                return content
+            size = len(content)
+        else:
+            size = int(file[0]['size'])
 
-            return f'[{file_name}](<https://drive.google.com/file/d/{file_id}/view?usp=sharing>)'
+        if size >= limit:
+            if file[0]["mimeType"].startswith(self.NATIVE_TYPE):
+                # Link to the converted file rather than to the Doc itself
+                if (url := file[0].get("exportLinks", {}).get(self.EXPORT_FORMATS[export_format])) is None:
+                    return f"This file converted to {export_format} is too large to send."
+                return self.share_link(file_id, f"{file_name}.{export_format.lower()}", url=url)
+            return self.share_link(file_id, file_name)
 
 
+        # Exports run on worker threads, so files are sent from memory rather than through a temporary directory that another export could clear
+        if file[0]["mimeType"].startswith(self.NATIVE_TYPE):
+            return File(BytesIO(content), filename=f"{file_name}.{export_format.lower()}")
+
         try:
             # pylint: disable=maybe-no-member
             request = (
                 self.service.files()
                 .get_media(fileId=file_id)
             )
+            request.http = self._http()
             file = BytesIO()
             downloader = MediaIoBaseDownload(file, request)
             done = False
             while done is False:
                 status, done = downloader.next_chunk()
                 # print(f"Download {int(status.progress() * 100)}.")
-            filepath = os.path.join("temp", file_name)
-            with open(filepath, "wb") as f:
-                file.seek(0)
-                f.write(file.read())
-
-            fileObj = file = File(filepath)
-            return fileObj
+            file.seek(0)
+            return File(file, filename=file_name)
         
         except HttpError:
             return "An error occured retrieving this file."
+
+    @_input_validator
+    def convert(self, file:dict, export_format:str="PDF", limit:int=8388608):
+        """Converts a Google Docs, Sheets or Slides file to another format on Drive's side.
+        Converted files are kept in a small LRU cache keyed by the file's id, modification time and the format,
+        so repeated requests for an unchanged file skip the conversion. Files too large to send are not cached.
+
+        Args:
+            file (dict): The file, as returned by search with the 'modifiedTime' field.
+            export_format (str, optional): One of EXPORT_FORMATS. Defaults to "PDF".
+            limit (int, optional): Size in bytes from which a converted file is too large to send. Defaults to 8388608.
+
+        Returns:
+            bytes: The converted file, or a message if it could not be converted.
+        """
+        if export_format not in self.EXPORT_FORMATS:
+            return f"`{export_format}` is not a supported format, please use one of {', '.join(self.EXPORT_FORMATS)}."
+
+        key = (file["id"], file["modifiedTime"], export_format)
+        with self.exports_lock:
+            if (content := self.exports.get(key)) is not None:
+                self.exports.move_to_end(key)
+                return content
+
+        try:
+            content = self.service.files().export(fileId=file["id"], mimeType=self.EXPORT_FORMATS[export_format]).execute(http=self._http())
+        except HttpError:
+            return f"This file cannot be exported as {export_format}."
+
+        if len(content) < limit:
+            with self.exports_lock:
+                self.exports[key] = content
+                if len(self.exports) > self.EXPORT_CACHE_SIZE:
+                    self.exports.popitem(last=False)
+        return content
         
-    def revoke_sharing(self, file_id:str):
-        self.service.permissions().delete(fileId=file_id, permissionId="anyoneWithLink").execute()
+    @_input_validator
+    def share_link(self, file_id:str, file_name:str, url:str="") -> str:
+        """Makes a file readable by anyone with its link, reusing the grant of any earlier request that is still live.
+        Every call must be matched by a call to release_link once the link is no longer needed.
+
+        Args:
+            file_id (str): ID of the file to share.
+            file_name (str): Name to show for the link.
+            url (str, optional): Where the link points, such as one of the file's export links. Defaults to the file's page.
+
+        Returns:
+            SharedLink: A markdown link to the file, or a plain message if it could not be shared.
+        """
+        # links_lock only guards the holder counts, while each file's own lock is held across its grant's network calls,
+        # so sharing one file does not wait on another and a grant is never created while it is still being revoked
+        with self.links_lock:
+            link = self.links.setdefault(file_id, {"id": None, "holders": 0, "lock": Lock()})
+            link["holders"] += 1
+
+        with link["lock"]:
+            if link["id"] is None:
+                # Drive does not accept an expiration time on 'anyone' grants, so the grant lives until release_link revokes it
+                permissions = {
+                    'type': 'anyone',
+                    'role': 'reader'
+                }
+                try:
+                    link["id"] = self.service.permissions().create(fileId=file_id, body=permissions).execute(http=self._http())["id"]
+                except HttpError as error:
+                    print(f"An error occurred: {error}")
+                    with self.links_lock:
+                        link["holders"] -= 1
+                        if link["holders"] == 0 and self.links.get(file_id) is link:
+                            del self.links[file_id]
+                    return "An error occured sharing this file."
+
+        return SharedLink(file_id, file_name, url or f"https://drive.google.com/file/d/{file_id}/view?usp=sharing")
+
+    @_input_validator
+    def release_link(self, file_id:str):
+        """Drops one holder of a link made by share_link, and revokes the grant once nobody holds it.
+
+        Args:
+            file_id (str): ID of the shared file.
+        """
+        with self.links_lock:
+            if (link := self.links.get(file_id)) is None:
+                return
+            link["holders"] -= 1
+            if link["holders"] > 0:
+                return
+
+        with link["lock"]:
+            # Someone may have shared the file again while this call waited for the lock
+            with self.links_lock:
+                if link["holders"] > 0 or link["id"] is None:
+                    return
+            try:
+                self.service.permissions().delete(fileId=file_id, permissionId=link["id"]).execute(http=self._http())
+                link["id"] = None
+            except HttpError as error:
+                print(f"An error occurred: {error}")
+            with self.links_lock:
+                if link["holders"] == 0 and self.links.get(file_id) is link:
+                    del self.links[file_id]
 
 
 
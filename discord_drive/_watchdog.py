@@ -0,0 +1,105 @@
+import logging
+import sys
+import threading
+import traceback
+
+from asyncio import AbstractEventLoop, sleep
+from collections import deque
+from datetime import datetime
+from time import perf_counter
+
+logger = logging.getLogger("discord_drive")
+
+class StallWatchdog:
+
+    def __init__(self, cog, api, threshold:float=0.25, interval:float=0.05, history:int=50):
+        """Watches an event loop for callbacks that block it, and samples the stack of the blocking code.
+        Each sample is tagged with the slash command and DriveAPI method that were running.
+
+        Args:
+            cog: The cog whose public methods are slash commands
+            api: The DriveAPI instance used by the cog
+            threshold (float, optional): Seconds the loop must be blocked for to count as a stall. Defaults to 0.25.
+            interval (float, optional): Seconds between heartbeats. Defaults to 0.05.
+            history (int, optional): Number of stalls to keep. Defaults to 50.
+        """
+        self.cog = cog
+        self.api = api
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = deque(maxlen=history)
+
+        self.lag = 0
+        self.max_lag = 0
+        self.beat = None
+        self.loop_thread = None
+        self.ticker = threading.Event()
+
+        # The loop only keeps a weak reference to its tasks, so the heartbeat is kept here
+        self.heartbeat = None
+        self.watcher = None
+
+    @property
+    def running(self) -> bool:
+        return self.heartbeat is not None and not self.heartbeat.done() and not self.heartbeat.get_loop().is_closed()
+
+    def start(self, loop:AbstractEventLoop):
+        """Starts the heartbeat on the loop and the watching thread, or restarts them if the loop they ran on has stopped.
+        Must be called from the loop's thread.
+        """
+        if self.running:
+            return
+        self.loop_thread = threading.get_ident()
+        self.beat = perf_counter()
+        self.heartbeat = loop.create_task(self._heartbeat())
+        if self.watcher is None or not self.watcher.is_alive():
+            self.watcher = threading.Thread(target=self._watch, name="discord_drive watchdog", daemon=True)
+            self.watcher.start()
+
+    async def _heartbeat(self):
+        while True:
+            start = perf_counter()
+            await sleep(self.interval)
+            now = perf_counter()
+            self.lag = now - start - self.interval
+            self.max_lag = max(self.max_lag, self.lag)
+
+            # The sample was taken mid-stall, so record how long the stall lasted now that it is over
+            if self.stalls and self.stalls[-1]["beat"] == self.beat:
+                stall = self.stalls[-1]
+                stall["duration"] = now - self.beat
+                logger.warning(f"Event loop blocked for {stall['duration']:.2f}s in /{stall['command']} ({stall['method']})\n{''.join(stall['stack'][-5:])}")
+            self.beat = now
+
+    def _watch(self):
+        sampled = None
+        while True:
+            self.ticker.wait(self.interval)
+            if not self.running:
+                continue
+            beat = self.beat
+            if perf_counter() - beat > self.threshold and sampled != beat:
+                sampled = beat
+                if (frame := sys._current_frames().get(self.loop_thread)) is not None:
+                    self.stalls.append(self._sample(frame, beat))
+
+    def _sample(self, frame, beat:float) -> dict:
+        command = method = None
+        for f, _ in traceback.walk_stack(frame):
+            owner = f.f_locals.get("self")
+            name = f.f_code.co_name
+            if name.startswith("_"):
+                continue
+            # Keep the outermost matches, as those are what the command and the cog called
+            if owner is self.cog:
+                command = name
+            elif owner is self.api:
+                method = name
+        return {
+            "beat": beat,
+            "time": datetime.now(),
+            "duration": perf_counter() - beat,
+            "command": command,
+            "method": method,
+            "stack": traceback.format_stack(frame, limit=15)
+        }
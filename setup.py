@@ -21,10 +21,15 @@ description = """
 ## Commands:
 `/authenticate`: Regenerates the token needed to enable the API. If re-authentication is needed, the bot will DM the caller a link and wait for the authentication code given to the caller by Google\\
 `/cd <directory>`: Navigates the caller down into a child directory of their current directory. Autocomplete is provided for hints.\\
-`/download <file> <timeout (optional)> <public (optional)>`: Gives the user the file (or a link) to download the file specified. Files have autocomplete. Timeout defaults to 60 seconds, where the file will then no longer be allowed to be downloaded. Public defaults to False, where no other users can see the file.\\
+`/diagnostics`: Shows administrators how long the bot has been blocked by slow work, which commands and Google Drive calls caused it, and where the latest stall happened.\\
+`/download <file> <timeout (optional)> <public (optional)> <format (optional)>`: Gives the user the file (or a link) to download the file specified. Files have autocomplete. Timeout defaults to 60 seconds, where the file will then no longer be allowed to be downloaded. Public defaults to False, where no other users can see the file. Google Docs, Sheets and Slides are converted to the chosen format, which defaults to PDF.\\
+`/du`: Shows the caller how much space their current directory and its largest folders use, along with the space used in the Google Drive account.\\
+`/find <query>`: Searches the names and contents of every file under the root. Results load page by page, and the menu below each page moves the caller straight to the folder containing a result.\\
 `/ls`: Shows the caller the contents of their current directory.\\
+`/preview <file>`: Shows the caller a thumbnail and the details of a file from their current directory without downloading it. Files have autocomplete.\\
 `/pwd`: Shows the caller the file path of their current directory.\\
-`/share <file> <user> <timeout (optional)>`: Sends a specified server member a dm with a file from the caller's current directory. Files and users have autocomplete. Timeout defaults to 60 seconds, where the file will then no longer be allowed to be downloaded.\\
+`/share <file> <user> <timeout (optional)> <format (optional)>`: Sends a specified server member a dm with a file from the caller's current directory. Files and users have autocomplete. Timeout defaults to 60 seconds, where the file will then no longer be allowed to be downloaded. Google Docs, Sheets and Slides are converted to the chosen format, which defaults to PDF.\\
+`/tree <depth (optional)> <files (optional)>`: Shows the caller the folders below their current directory, and their files if requested. Depth defaults to 2 levels.\\
 `/upload <attachment>`: Uploads a file or zip file to the caller's current directory. Zip files must contain just the files, and no folders, as they will not be read.
 """
 
@@ -41,6 +46,7 @@ setup(
     install_requires=[
         'py-cord',
         'google_api_python_client',
+        'google_auth_httplib2',
         'google_auth_oauthlib',
         'numpy',
         'opencv_python',
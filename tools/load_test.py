@@ -0,0 +1,461 @@
+"""Load generator for the DiscordDrive cog.
+
+Simulates many Discord users issuing a mix of `/cd`, `/ls`, autocomplete, `/upload`, `/download` and `/du`
+against a local fake Google Drive and fake Discord interactions, and reports throughput, tail latency,
+event loop lag and failures as the number of concurrent users rises.
+
+Usage:
+    python tools/load_test.py --levels 1,10,50,100,200 --ops 5 --latency 40
+"""
+import argparse
+import asyncio
+import os
+import pathlib
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+
+from collections import Counter
+from itertools import count
+
+import cv2
+import httplib2
+import numpy as np
+
+from discord.ext.pages import Paginator
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from discord_drive._discord_drive import DriveAPICommands
+from discord_drive._drive import DriveAPI
+
+# Discord drops an interaction that has not been acknowledged within 3 seconds
+ACK_DEADLINE = 3
+GUILD_LIMIT = 8388608
+MIX = {"cd": 25, "ls": 25, "autocomplete": 25, "upload": 10, "download": 15, "du": 5}
+
+
+class FakeRequest:
+
+    def __init__(self, run=None, uri: str = "", http=None):
+        self.run = run
+        self.uri = uri
+        self.http = http
+        self.headers = {}
+
+    def execute(self, http=None, num_retries=0):
+        return self.run()
+
+
+class FakeDrive:
+
+    def __init__(self, folders: int = 6, depth: int = 3, files: int = 12, latency: float = 0.04, seed: int = 0):
+        """Local stand-in for the Drive v3 service, holding a generated tree of folders and files.
+        Every request blocks for `latency` seconds, like the real client does.
+
+        Args:
+            folders (int, optional): Subfolders per folder. Defaults to 6.
+            depth (int, optional): Depth of the folder tree. Defaults to 3.
+            files (int, optional): Files per folder. Defaults to 12.
+            latency (float, optional): Seconds each request takes. Defaults to 0.04.
+            seed (int, optional): Seed for the generated tree. Defaults to 0.
+        """
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.store = dict()
+        self.ids = count()
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.changelog = []
+        self.root = self.add("Root", DriveAPI.FOLDER_TYPE, "")
+        self.populate(self.root, folders, depth, files)
+
+    def add(self, name: str, mime_type: str, parent: str, content: bytes = b"", size: int = None) -> str:
+        with self.lock:
+            file_id = f"id{next(self.ids)}"
+            self.store[file_id] = {
+                "id": file_id,
+                "name": name,
+                "mimeType": mime_type,
+                "parents": [parent],
+                "modifiedTime": "2024-01-01T00:00:00.000Z",
+                "content": content,
+                "size": size if size is not None else len(content)
+            }
+            self.changelog.append(file_id)
+        return file_id
+
+    def populate(self, parent: str, folders: int, depth: int, files: int):
+        for i in range(files):
+            kind = self.random.random()
+            if kind < 0.2:
+                self.add(f"Notes {i}", "application/vnd.google-apps.document", parent)
+            elif kind < 0.3:
+                self.add(f"Scan {i}.pdf", "application/pdf", parent, size=GUILD_LIMIT * 2)
+            else:
+                self.add(f"File {i}.pdf", "application/pdf", parent, content=self.random.randbytes(self.random.randint(1024, 65536)))
+        if depth > 1:
+            for i in range(folders):
+                self.populate(self.add(f"Folder {i}", DriveAPI.FOLDER_TYPE, parent), folders, depth - 1, files)
+
+    def request(self, name: str, run) -> FakeRequest:
+        def timed():
+            time.sleep(self.latency)
+            self.calls[name] += 1
+            return run()
+        return FakeRequest(timed)
+
+    def metadata(self, file: dict) -> dict:
+        metadata = {key: file[key] for key in ("id", "name", "mimeType", "parents", "modifiedTime")}
+        if not file["mimeType"].startswith(DriveAPI.NATIVE_TYPE):
+            metadata["size"] = str(file["size"])
+        return metadata
+
+    def files(self):
+        return _Files(self)
+
+    def permissions(self):
+        return _Permissions(self)
+
+    def changes(self):
+        return _Changes(self)
+
+    def about(self):
+        return _About(self)
+
+
+class _Files:
+
+    def __init__(self, drive: FakeDrive):
+        self.drive = drive
+
+    def list(self, q: str, pageSize: int = 100, pageToken: str = "", **kwargs) -> FakeRequest:
+        def run():
+            found = list(self.drive.store.values())
+            if (parents := set(re.findall(r"'([^']+)' in parents", q))):
+                found = [file for file in found if parents.intersection(file["parents"])]
+            if (name := re.search(r"name = '((?:[^'\\]|\\.)*)'", q)):
+                found = [file for file in found if file["name"] == name.group(1).replace("\\'", "'")]
+            if (name := re.search(r"name contains '((?:[^'\\]|\\.)*)'", q)):
+                found = [file for file in found if name.group(1).replace("\\'", "'").casefold() in file["name"].casefold()]
+            if f"mimeType!='{DriveAPI.FOLDER_TYPE}'" in q:
+                found = [file for file in found if file["mimeType"] != DriveAPI.FOLDER_TYPE]
+            elif f"mimeType='{DriveAPI.FOLDER_TYPE}'" in q:
+                found = [file for file in found if file["mimeType"] == DriveAPI.FOLDER_TYPE]
+            found.sort(key=lambda file: (file["mimeType"] != DriveAPI.FOLDER_TYPE, file["name"]))
+
+            start = int(pageToken or 0)
+            results = {"files": [self.drive.metadata(file) for file in found[start:start + pageSize]]}
+            if start + pageSize < len(found):
+                results["nextPageToken"] = str(start + pageSize)
+            return results
+        return self.drive.request("files.list", run)
+
+    def get(self, fileId: str, fields: str = "") -> FakeRequest:
+        return self.drive.request("files.get", lambda: self.drive.metadata(self.drive.store[fileId]))
+
+    def create(self, body: dict, media_body=None, fields: str = "") -> FakeRequest:
+        def run():
+            content = media_body.getbytes(0, media_body.size()) if media_body is not None else b""
+            return self.drive.metadata(self.drive.store[self.drive.add(body["name"], body["mimeType"], body["parents"][0], content=content)])
+        return self.drive.request("files.create", run)
+
+    def export(self, fileId: str, mimeType: str) -> FakeRequest:
+        return self.drive.request("files.export", lambda: self.drive.store[fileId]["name"].encode() * 1024)
+
+    def get_media(self, fileId: str) -> FakeRequest:
+        return FakeRequest(uri=fileId, http=_MediaHttp(self.drive))
+
+
+class _MediaHttp:
+
+    def __init__(self, drive: FakeDrive):
+        self.drive = drive
+
+    def request(self, uri, method="GET", headers=None, **kwargs):
+        """Answers the ranged reads made by MediaIoBaseDownload the way Drive does
+        """
+        time.sleep(self.drive.latency)
+        self.drive.calls["files.get_media"] += 1
+        content = self.drive.store[uri]["content"]
+        start, end = map(int, re.match(r"bytes=(\d+)-(\d+)", (headers or {}).get("range", f"bytes=0-{len(content) - 1}")).groups())
+        chunk = content[start:end + 1]
+        return httplib2.Response({"status": "206", "content-range": f"bytes {start}-{start + len(chunk) - 1}/{len(content)}"}), chunk
+
+
+class _Permissions:
+
+    def __init__(self, drive: FakeDrive):
+        self.drive = drive
+
+    def create(self, fileId: str, body: dict, **kwargs) -> FakeRequest:
+        return self.drive.request("permissions.create", lambda: {"id": "anyoneWithLink"})
+
+    def delete(self, fileId: str, permissionId: str, **kwargs) -> FakeRequest:
+        return self.drive.request("permissions.delete", lambda: {})
+
+
+class _Changes:
+
+    def __init__(self, drive: FakeDrive):
+        self.drive = drive
+
+    def getStartPageToken(self) -> FakeRequest:
+        return self.drive.request("changes.getStartPageToken", lambda: {"startPageToken": str(len(self.drive.changelog))})
+
+    def list(self, pageToken: str, **kwargs) -> FakeRequest:
+        def run():
+            changed = self.drive.changelog[int(pageToken):]
+            return {
+                "changes": [{"fileId": file_id, "removed": False, "file": self.drive.metadata(self.drive.store[file_id])} for file_id in changed],
+                "newStartPageToken": str(int(pageToken) + len(changed))
+            }
+        return self.drive.request("changes.list", run)
+
+
+class _About:
+
+    def __init__(self, drive: FakeDrive):
+        self.drive = drive
+
+    def get(self, fields: str = "") -> FakeRequest:
+        return self.drive.request("about.get", lambda: {"storageQuota": {
+            "limit": str(15 * 1024 ** 3),
+            "usage": str(sum(file["size"] for file in self.drive.store.values())),
+            "usageInDrive": str(sum(file["size"] for file in self.drive.store.values())),
+            "usageInDriveTrash": "0"
+        }})
+
+
+class FakeAvatar:
+
+    AVATAR = cv2.imencode(".png", np.full((64, 64, 3), 128, dtype=np.uint8))[1].tobytes()
+
+    url = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+    def with_format(self, format: str):
+        return self
+
+    async def read(self) -> bytes:
+        return self.AVATAR
+
+
+class FakeUser:
+
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.mention = f"<@{user_id}>"
+        self.display_avatar = FakeAvatar()
+
+    async def send(self, *args, **kwargs):
+        pass
+
+
+class FakeResponse:
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+
+    def is_done(self) -> bool:
+        return self.ctx.acked is not None
+
+    async def defer(self, *args, **kwargs):
+        self.ctx.ack()
+
+    async def send_message(self, *args, **kwargs):
+        self.ctx.ack()
+
+
+class FakeInteraction:
+
+    def __init__(self, ctx):
+        self.user = ctx.author
+        self.response = FakeResponse(ctx)
+
+
+class FakeContext:
+
+    def __init__(self, user: FakeUser):
+        """Stands in for the ApplicationContext of a single slash command, recording when it was first acknowledged
+        """
+        self.author = user
+        self.guild = type("FakeGuild", (), {"filesize_limit": GUILD_LIMIT})()
+        self.interaction = FakeInteraction(self)
+        self.response = self.interaction.response
+        self.created = time.perf_counter()
+        self.acked = None
+
+    def ack(self):
+        if self.acked is None:
+            self.acked = time.perf_counter()
+
+    async def defer(self, *args, **kwargs):
+        self.ack()
+
+    async def send_response(self, *args, **kwargs):
+        self.ack()
+
+    async def respond(self, *args, **kwargs):
+        self.ack()
+
+    async def send_followup(self, *args, **kwargs):
+        if (file := kwargs.get("file")) is not None:
+            file.close()
+
+
+class FakeAttachment:
+
+    def __init__(self, filename: str, content: bytes):
+        self.filename = filename
+        self.content_type = "text/plain"
+        self.content = content
+
+    async def save(self, path: str):
+        with open(path, "wb") as f:
+            f.write(self.content)
+
+
+async def _respond(self, interaction, ephemeral: bool = False, **kwargs):
+    await interaction.response.send_message(embeds=self.pages[0], view=self, ephemeral=ephemeral)
+
+
+class LoadTest:
+
+    def __init__(self, drive: FakeDrive, ops: int, seed: int = 0):
+        """Runs simulated users against a DriveAPICommands cog backed by a FakeDrive
+
+        Args:
+            drive (FakeDrive): The fake Drive to serve requests from
+            ops (int): Number of commands each simulated user runs
+            seed (int, optional): Seed for the users' choices. Defaults to 0.
+        """
+        self.drive = drive
+        self.ops = ops
+        self.random = random.Random(seed)
+        self.users = count(1)
+
+        # Nothing in the working directory should decide whether the cog talks to the real Drive
+        self.cog = DriveAPICommands(None, "https://drive.google.com/drive/folders/none")
+        self.cog.API.service = drive
+        self.cog.API.ROOT = self.cog.root = "Root"
+        self.cog.API.ROOT_ID = drive.root
+        # Every thread's http object is the fake, so media downloads given one are still answered locally
+        self.cog.API._http = lambda: _MediaHttp(drive)
+        self.cog.root_path = pathlib.Path("Root")
+        self.cog._cache_listing(self.cog.root_path, drive.root)
+
+    async def command(self, name: str, user: FakeUser) -> FakeContext:
+        ctx = FakeContext(user)
+        if name == "cd":
+            folders = DriveAPICommands._drive_state[DriveAPICommands._wd_cache[user.id][0]]["folders"]
+            path = self.random.choice(folders) if folders and self.random.random() < 0.8 else ".."
+            await self.cog.cd.callback(self.cog, ctx, path)
+        elif name == "ls":
+            await self.cog.ls.callback(self.cog, ctx)
+        elif name == "autocomplete":
+            ctx.ack()
+            await DriveAPICommands._get_folders(ctx)
+            await DriveAPICommands._get_files(ctx)
+        elif name == "upload":
+            attachment = FakeAttachment(f"upload {user.id} {self.random.randrange(1 << 30)}.txt", self.random.randbytes(4096))
+            await self.cog.upload.callback(self.cog, ctx, attachment)
+        elif name == "download":
+            files = DriveAPICommands._drive_state[DriveAPICommands._wd_cache[user.id][0]]["files"]
+            if not files:
+                return await self.command("ls", user)
+            await self.cog.download.callback(self.cog, ctx, self.random.choice(files), "0", False, "PDF")
+        elif name == "du":
+            await self.cog.du.callback(self.cog, ctx)
+        return ctx
+
+    async def user(self, stage: dict):
+        user = FakeUser(next(self.users))
+        for _ in range(self.ops):
+            name = self.random.choices(list(MIX), weights=list(MIX.values()))[0]
+            start = time.perf_counter()
+            try:
+                ctx = await self.command(name, user)
+                stage["latency"].append(time.perf_counter() - start)
+                stage["ack"].append((ctx.acked or time.perf_counter()) - ctx.created)
+            except Exception as error:
+                stage["failures"][f"{name}: {type(error).__name__}: {str(error)[:80]}"] += 1
+
+    async def monitor(self, lags: list, interval: float = 0.05):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - start - interval)
+
+    async def stage(self, concurrency: int) -> dict:
+        stage = {"concurrency": concurrency, "latency": [], "ack": [], "lag": [], "failures": Counter()}
+        calls = sum(self.drive.calls.values())
+        monitor = asyncio.create_task(self.monitor(stage["lag"]))
+        start = time.perf_counter()
+        await asyncio.gather(*[self.user(stage) for _ in range(concurrency)])
+        stage["elapsed"] = time.perf_counter() - start
+        monitor.cancel()
+        stage["calls"] = sum(self.drive.calls.values()) - calls
+        return stage
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def report(stages: list, max_failure_rate: float):
+    print(f"{'users':>6} {'ops':>6} {'ops/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'ack p99':>8} {'late':>6} {'lag max':>8} {'calls':>6} {'failed':>6}")
+    capacity, within = 0, True
+    for stage in stages:
+        ops = len(stage["latency"]) + sum(stage["failures"].values())
+        late = sum(ack > ACK_DEADLINE for ack in stage["ack"])
+        print(f"{stage['concurrency']:>6} {ops:>6} {ops / stage['elapsed']:>8.1f} "
+              f"{percentile(stage['latency'], 0.5) * 1000:>8.0f} {percentile(stage['latency'], 0.95) * 1000:>8.0f} {percentile(stage['latency'], 0.99) * 1000:>8.0f} "
+              f"{percentile(stage['ack'], 0.99) * 1000:>8.0f} {late:>6} {max(stage['lag'], default=0) * 1000:>8.0f} {stage['calls']:>6} {sum(stage['failures'].values()):>6}")
+        # Capacity is the highest level reached before the first one that broke the failure budget
+        within = within and ops > 0 and (late + sum(stage["failures"].values())) / ops <= max_failure_rate
+        if within:
+            capacity = stage["concurrency"]
+
+    failures = sum((stage["failures"] for stage in stages), Counter())
+    if failures:
+        print("\nFailure modes:")
+        for failure, n in failures.most_common(10):
+            print(f"{n:>6}  {failure}")
+
+    print(f"\n'late' counts interactions acknowledged after Discord's {ACK_DEADLINE} second deadline.")
+    print(f"Capacity: {capacity} concurrent users" if capacity else "Capacity: the cog did not stay within the failure budget at the lowest level.")
+
+
+async def main(args):
+    drive = FakeDrive(folders=args.folders, depth=args.depth, files=args.files, latency=args.latency / 1000, seed=args.seed)
+    test = LoadTest(drive, ops=args.ops, seed=args.seed)
+    stages = []
+    for concurrency in args.levels:
+        stages.append(await test.stage(concurrency))
+    report(stages, args.max_failure_rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the number of concurrent users the DiscordDrive cog can serve.")
+    parser.add_argument("--levels", type=lambda s: [int(n) for n in s.split(",")], default=[1, 10, 25, 50, 100, 200, 400], help="Comma separated numbers of concurrent users to try, in order")
+    parser.add_argument("--ops", type=int, default=5, help="Commands run by each user at every level")
+    parser.add_argument("--latency", type=float, default=40, help="Milliseconds each fake Drive request takes")
+    parser.add_argument("--folders", type=int, default=6, help="Subfolders per folder in the fake Drive")
+    parser.add_argument("--depth", type=int, default=3, help="Depth of the fake Drive's folder tree")
+    parser.add_argument("--files", type=int, default=12, help="Files per folder in the fake Drive")
+    parser.add_argument("--max-failure-rate", type=float, default=0.01, help="Share of failed or late commands tolerated at the capacity level")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # The cog reads token.json and writes to temp/ relative to the working directory, so keep both away from the bot's
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        Paginator.respond = _respond
+        asyncio.run(main(args))